@@ -0,0 +1,218 @@
+"""In-memory barcode index for on-site check-in
+
+CheckinIndex maps full barcodes to slim attendee records for one or more
+events, so scanners can validate a barcode with a single dictionary lookup.
+
+1) Attendees are fetched with list_event_attendees(show_full_barcodes=True)
+2) Each refresh rebuilds the index into a new dict, dropping refunded or
+   cancelled attendees and picking up barcodes used at other doors
+3) Lookups never wait on a refresh - the new dict is swapped in with one assignment
+"""
+import logging
+import sys
+import threading
+import time
+
+ATTENDEE_PAGE_SIZE = 500
+REFRESH_INTERVAL = 15
+
+BARCODE_STATUS_USED = 'used'
+
+# Error type Eventbrite returns for an event without attendees or a page past the last one
+NOT_FOUND_ERROR = 'Not Found'
+
+EVENTBRITE_LOGGER = logging.getLogger(__name__)
+
+class CheckinRecord(object):
+    """What the door needs to know about one barcode"""
+    __slots__ = ('barcode', 'event_id', 'attendee_id', 'ticket_id', 'first_name', 'last_name', 'checked_in_at')
+
+    def __init__(self, barcode, event_id, attendee_id, ticket_id=None, first_name=None, last_name=None, checked_in_at=None):
+        self.barcode = barcode
+        self.event_id = event_id
+        self.attendee_id = attendee_id
+        self.ticket_id = ticket_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.checked_in_at = checked_in_at
+
+    @property
+    def checked_in(self):
+        return self.checked_in_at is not None
+
+    def __repr__(self):
+        return "<CheckinRecord %s event=%r attendee=%r checked_in=%r>" % (self.barcode, self.event_id, self.attendee_id, self.checked_in)
+
+def _attendee_barcodes(attendee):
+    """Yields (barcode, status) for every barcode on an attendee"""
+    for wrapped_barcode in attendee.get('barcodes') or []:
+        barcode = wrapped_barcode.get('barcode', wrapped_barcode)
+        if barcode.get('id'):
+            yield str(barcode['id']), barcode.get('status')
+
+    # Older responses carry a single barcode string on the attendee
+    if attendee.get('barcode'):
+        yield str(attendee['barcode']), None
+
+class CheckinIndex(object):
+    """Barcode to attendee index for one or more events"""
+    def __init__(self, client, event_ids=(), page_size=ATTENDEE_PAGE_SIZE):
+        """Initialize the index
+
+        client    - EventbriteClient - Authenticated client used to fetch attendees
+        event_ids - list of ints     - Events to index, more can be added with add_event()
+        page_size - int              - Attendees requested per list_event_attendees call
+        """
+        self._client = client
+        self._page_size = page_size
+
+        self._records = {}
+        self._event_ids = set()
+
+        self._refresh_lock = threading.Lock()
+        self._checkin_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        for event_id in event_ids:
+            self.add_event(event_id)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, barcode):
+        return barcode in self._records
+
+    def add_event(self, event_id):
+        """Adds event_id to the index, its attendees are fetched on the next refresh"""
+        assert type(event_id) == int
+        self._refresh_lock.acquire()
+        try:
+            self._event_ids.add(event_id)
+        finally:
+            self._refresh_lock.release()
+
+    def lookup(self, barcode):
+        """Returns the CheckinRecord for barcode, or None if it is not a known barcode"""
+        return self._records.get(barcode)
+
+    def check_in(self, barcode):
+        """Records a local check-in for barcode
+
+        Returns: (CheckinRecord, True) on first check-in, (CheckinRecord, False) if already checked in
+        Raises: KeyError if barcode is unknown
+        """
+        record = self._records.get(barcode)
+        if record is None:
+            raise KeyError(barcode)
+
+        self._checkin_lock.acquire()
+        try:
+            if record.checked_in_at is not None:
+                return record, False
+            record.checked_in_at = time.time()
+            return record, True
+        finally:
+            self._checkin_lock.release()
+
+    def refresh(self):
+        """Rebuilds the index from the current attendees of every indexed event
+
+        If an event fails to refresh, its previous records are kept, the other
+        events are still refreshed and the first error is raised afterwards.
+
+        Returns: The number of barcodes in the index
+        """
+        self._refresh_lock.acquire()
+        try:
+            old_records = self._records
+            new_records = {}
+            first_error = None
+            for event_id in self._event_ids:
+                try:
+                    attendee_list = self._fetch_attendees(event_id)
+                except Exception:
+                    if first_error is None:
+                        first_error = sys.exc_info()[1]
+                    for barcode, record in old_records.iteritems():
+                        if record.event_id == event_id:
+                            new_records[barcode] = record
+                    continue
+
+                for attendee in attendee_list:
+                    self._index_attendee(event_id, attendee, old_records, new_records)
+
+            self._records = new_records
+            if first_error is not None:
+                raise first_error
+            return len(new_records)
+        finally:
+            self._refresh_lock.release()
+
+    def start(self, interval=REFRESH_INTERVAL):
+        """Refreshes the index every interval seconds in a background daemon thread"""
+        assert self._thread is None, "Refresh already started"
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval, ), name='eventbrite-checkin-index')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the background thread started with start()"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop_event.isSet():
+            try:
+                self.refresh()
+            except Exception:
+                EVENTBRITE_LOGGER.exception("Failed to refresh check-in index")
+            self._stop_event.wait(interval)
+
+    def _fetch_attendees(self, event_id):
+        """Returns every attendee of event_id
+
+        Raises: ValueError on any error other than "Not Found"
+        """
+        attendee_list = []
+        page = 1
+        while True:
+            api_response = self._client.list_event_attendees(event_id=event_id, count=self._page_size, page=page,
+                exclude_answers=True, exclude_address=True, show_full_barcodes=True)
+            if api_response and 'error' in api_response:
+                # On page 1 this means the event has no attendees, later it means no more pages
+                if api_response['error'].get('error_type') == NOT_FOUND_ERROR:
+                    return attendee_list
+                raise ValueError("Eventbrite error for event %r page %r: %r" % (event_id, page, api_response['error']))
+
+            page_attendees = [wrapped_attendee['attendee'] for wrapped_attendee in api_response.get('attendees', [])]
+            attendee_list.extend(page_attendees)
+            if len(page_attendees) < self._page_size:
+                return attendee_list
+            page += 1
+
+    def _index_attendee(self, event_id, attendee, old_records, new_records):
+        attendee_id = int(attendee['id'])
+        for barcode, status in _attendee_barcodes(attendee):
+            record = old_records.get(barcode)
+            if record is None:
+                record = CheckinRecord(barcode, event_id, attendee_id)
+
+            # Reuse the existing record so check-ins made during the rebuild are kept
+            record.event_id = event_id
+            record.attendee_id = attendee_id
+            record.ticket_id = attendee.get('ticket_id')
+            record.first_name = attendee.get('first_name')
+            record.last_name = attendee.get('last_name')
+            if status == BARCODE_STATUS_USED:
+                self._checkin_lock.acquire()
+                try:
+                    if record.checked_in_at is None:
+                        record.checked_in_at = time.time()
+                finally:
+                    self._checkin_lock.release()
+
+            new_records[barcode] = record
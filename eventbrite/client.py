@@ -6,16 +6,41 @@ This client provides:
 3) Dictionary-based returns as described at http://developer.eventbrite.com/doc/
 """
 import datetime
-import httplib
 import logging
+import threading
 import urllib
+import zlib
 
 from eventbrite import json_lib
+from eventbrite.connection import EventbriteConnection, shared_ssl_context
 
 EVENTBRITE_URL = 'www.eventbrite.com'
-EVENTBRITE_API_TEMPLATE = 'https://%(host)s/json/%(method)s?%(arguments)s'
+EVENTBRITE_API_PATH_TEMPLATE = '/json/%(method)s'
 EVENTBRITE_DATE_STRING = "%Y-%m-%d %H:%M:%S"
 GET_REQUEST = 'GET'
+POST_REQUEST = 'POST'
+
+# API methods that change data are always sent as POST
+POST_API_METHODS = set([
+    'discount_new', 'discount_update',
+    'event_copy', 'event_new', 'event_update',
+    'organizer_new', 'organizer_update',
+    'payment_update',
+    'ticket_new', 'ticket_update',
+    'user_new',
+    'venue_new', 'venue_update',
+])
+
+# Arguments that should never end up in a URL (or a log line)
+SENSITIVE_ARGUMENTS = set(['password', 'passwd'])
+
+# Encoded arguments longer than this are sent as POST to stay clear of URL length limits
+MAX_GET_ARGUMENTS_LENGTH = 1024
+
+# POST bodies longer than this are gzipped when compression is enabled
+MIN_COMPRESSED_BODY_LENGTH = 1024
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
 
 EVENTBRITE_LOGGER = logging.getLogger(__name__)
 
@@ -35,14 +60,61 @@ def _boolean_true_or_false(is_true):
 def _comma_separated_list(input_list):
     return ",".join(input_list)
 
+def _gzip(data):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
 class EventbriteClient(object):
     """Client for Eventbrite's HTTP-based API"""
-    def __init__(self, app_key=None, user_key=None):
-        """Initialize the client with the given app key and the user key"""
+    def __init__(self, app_key=None, user_key=None, compress_requests=False, preconnect=False):
+        """Initialize the client with the given app key and the user key
+
+        compress_requests - boolean - gzip large POST bodies (Content-Encoding: gzip)
+        preconnect        - boolean - Open the HTTPS connection in a background thread right away
+        """
         self._app_key = app_key
         self._user_key = user_key
+        self._compress_requests = compress_requests
+
+        # Encoded once here rather than on every authenticated call
+        self._auth_arguments = None
+        if app_key and user_key:
+            self._auth_arguments = urllib.urlencode(dict(app_key=app_key, user_key=user_key))
+
+        ssl_context = shared_ssl_context()
+        if ssl_context is not None:
+            self._https_connection = EventbriteConnection(EVENTBRITE_URL, context=ssl_context)
+        else:
+            self._https_connection = EventbriteConnection(EVENTBRITE_URL)
 
-        self._https_connection = httplib.HTTPSConnection(EVENTBRITE_URL)
+        self._preconnect_thread = None
+        if preconnect:
+            self._preconnect_thread = threading.Thread(target=self._preconnect, name='eventbrite-preconnect')
+            self._preconnect_thread.setDaemon(True)
+            self._preconnect_thread.start()
+
+    def get_connect_timings(self):
+        """Returns a list of dicts with the seconds spent on DNS, TCP and TLS for each connect
+
+        Keys: dns, dns_cached, tcp, tls, total
+        """
+        self._wait_for_preconnect()
+        return list(self._https_connection.connect_timings)
+
+    def _preconnect(self):
+        try:
+            self._https_connection.connect()
+        except Exception:
+            # The first API call will connect (and raise) as usual
+            EVENTBRITE_LOGGER.warning("Pre-connect to %s failed", EVENTBRITE_URL, exc_info=True)
+            self._https_connection.close()
+
+    def _wait_for_preconnect(self):
+        # Read once - another thread may clear it between the check and the join
+        preconnect_thread = self._preconnect_thread
+        if preconnect_thread is not None:
+            preconnect_thread.join()
+            self._preconnect_thread = None
 
     ###########################################################################
     ############################ BEGIN DISCOUNTS ##############################
@@ -509,7 +581,7 @@ class EventbriteClient(object):
 
     # UNTESTED
     def list_user_organizers(self, user_email=None, password=None):
-        # WARNING: Spec indicates passing passwords through the GET request
+        # Passwords are sent in the POST body, see SENSITIVE_ARGUMENTS
         method_arguments = dict(
             user_email   = dict(target='user', type=str, value=user_email, required=True),
             password     = dict(target='password', type=str, value=password, required=True),
@@ -528,7 +600,7 @@ class EventbriteClient(object):
 
     # UNTESTED
     def list_user_venues(self, user_email=None, password=None):
-        # WARNING: Spec indicates passing passwords through the GET request
+        # Passwords are sent in the POST body, see SENSITIVE_ARGUMENTS
         method_arguments = dict(
             user_email   = dict(target='user', type=str, value=user_email, required=True),
             password     = dict(target='password', type=str, value=password, required=True),
@@ -540,7 +612,7 @@ class EventbriteClient(object):
 
     # UNTESTED
     def new_user(self, user_email=None, password=None):
-        # WARNING: Spec indicates passing passwords through the GET request
+        # Passwords are sent in the POST body, see SENSITIVE_ARGUMENTS
         method_arguments = dict(
             user_email   = dict(target='email', type=str, value=user_email, required=True),
             password     = dict(target='passwd', type=str, value=password, required=True),
@@ -552,8 +624,6 @@ class EventbriteClient(object):
 
     # UNTESTED
     def update_user(self, *args, **kwargs):
-        # WARNING: Spec indicates passing passwords through the GET request
-
         # NOT IMPLEMENTED: Ambiguous API docs.  No user_id required?
         # See http://developer.eventbrite.com/doc/users/user_update/
         raise NotImplementedError
@@ -642,24 +712,46 @@ class EventbriteClient(object):
         """Execute an API call on Eventbrite using their HTTP-based API
 
         api_method    - string  - Action identified - https://www.eventbrite.com/json/<api_method>
-        api_arguments - dict    - Arguments to pass along as GET parameters
+        api_arguments - dict    - Arguments to pass along as GET parameters or a POST body
         authenticate  - boolean - API call should be authenticated
 
+        Arguments are sent in a form-encoded POST body when api_method is in
+        POST_API_METHODS, an argument is in SENSITIVE_ARGUMENTS or the encoded
+        arguments are longer than MAX_GET_ARGUMENTS_LENGTH.  Otherwise they are
+        sent as a GET query string.
+
         Returns: A dictionary with a return structure defined at http://developer.eventbrite.com/doc/
         """
-        url_arguments = dict(api_arguments)
-        if authenticate:
-            assert self._app_key and self._user_key
-            url_arguments['app_key'] = self._app_key
-            url_arguments['user_key'] = self._user_key
+        self._wait_for_preconnect()
 
-        final_url_arguments = urllib.urlencode(url_arguments)
-        url_string = EVENTBRITE_API_TEMPLATE % dict(host=EVENTBRITE_URL, method=api_method, arguments=final_url_arguments)
+        encoded_arguments = urllib.urlencode(api_arguments)
+        if authenticate:
+            assert self._auth_arguments
+            if encoded_arguments:
+                encoded_arguments = '%s&%s' % (encoded_arguments, self._auth_arguments)
+            else:
+                encoded_arguments = self._auth_arguments
 
-        EVENTBRITE_LOGGER.debug("REQ - %s", url_string)
+        use_post = bool(
+            api_method in POST_API_METHODS or
+            SENSITIVE_ARGUMENTS.intersection(api_arguments) or
+            len(encoded_arguments) > MAX_GET_ARGUMENTS_LENGTH
+        )
 
-        # Send a GET request to Eventbrite
-        self._https_connection.request(GET_REQUEST, url_string)
+        url_path = EVENTBRITE_API_PATH_TEMPLATE % dict(method=api_method)
+        if EVENTBRITE_LOGGER.isEnabledFor(logging.DEBUG):
+            # Never log the encoded arguments - they carry keys and passwords
+            EVENTBRITE_LOGGER.debug("REQ - %s %s - %s", (use_post and POST_REQUEST) or GET_REQUEST, url_path, sorted(api_arguments))
+
+        if use_post:
+            request_body = encoded_arguments
+            request_headers = {'Content-Type': FORM_CONTENT_TYPE}
+            if self._compress_requests and len(request_body) >= MIN_COMPRESSED_BODY_LENGTH:
+                request_body = _gzip(request_body)
+                request_headers['Content-Encoding'] = 'gzip'
+            self._https_connection.request(POST_REQUEST, url_path, request_body, request_headers)
+        else:
+            self._https_connection.request(GET_REQUEST, '%s?%s' % (url_path, encoded_arguments))
 
         # Read the JSON response and automatically JSON deserialize
         response = self._https_connection.getresponse()
@@ -0,0 +1,149 @@
+"""HTTPS connection used by EventbriteClient
+
+EventbriteConnection is an httplib.HTTPSConnection that:
+1) Caches DNS results for DNS_CACHE_TTL seconds, shared by every connection in the process
+2) Can share one SSL context (and its loaded CA certificates) across connections
+3) Records how long DNS, TCP and TLS took for each connect
+
+Without the ssl module (Python 2.5) it falls back to httplib's own connect.
+"""
+import httplib
+import logging
+import socket
+import sys
+import threading
+import time
+
+# The ssl module is only provided in Python 2.6+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+DNS_CACHE_TTL = 300
+MAX_CONNECT_TIMINGS = 100
+
+EVENTBRITE_LOGGER = logging.getLogger(__name__)
+
+_dns_cache = {}
+_dns_cache_lock = threading.Lock()
+
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+def _resolve(host, port):
+    """Returns (address list, True if it came from the cache)"""
+    cache_key = (host, port)
+    _dns_cache_lock.acquire()
+    try:
+        cached_entry = _dns_cache.get(cache_key)
+    finally:
+        _dns_cache_lock.release()
+
+    if cached_entry is not None and cached_entry[1] > time.time():
+        return cached_entry[0], True
+
+    address_list = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    _dns_cache_lock.acquire()
+    try:
+        _dns_cache[cache_key] = (address_list, time.time() + DNS_CACHE_TTL)
+    finally:
+        _dns_cache_lock.release()
+    return address_list, False
+
+def _forget(host, port):
+    _dns_cache_lock.acquire()
+    try:
+        _dns_cache.pop((host, port), None)
+    finally:
+        _dns_cache_lock.release()
+
+def shared_ssl_context():
+    """Returns the process-wide SSL context, or None if ssl predates SSLContext
+
+    Pass it as EventbriteConnection(context=...) so CA certificates are loaded once per process.
+    """
+    global _ssl_context
+    if ssl is None or not hasattr(ssl, 'create_default_context'):
+        return None
+
+    _ssl_context_lock.acquire()
+    try:
+        if _ssl_context is None:
+            # Same default httplib uses, including any PEP 476 opt-out
+            _ssl_context = ssl._create_default_https_context()
+        return _ssl_context
+    finally:
+        _ssl_context_lock.release()
+
+class EventbriteConnection(httplib.HTTPSConnection):
+    """HTTPS connection with DNS caching and connect timings"""
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+        self.connect_timings = []
+
+    def connect(self):
+        """Same as HTTPSConnection.connect, with cached DNS results and timings"""
+        if ssl is None:
+            httplib.HTTPSConnection.connect(self)
+            return
+
+        # source_address and tunnels are only provided in Python 2.7 and 2.6.3+
+        source_address = getattr(self, 'source_address', None)
+        tunnel_host = getattr(self, '_tunnel_host', None)
+
+        start_time = time.time()
+        # With a tunnel, self.host is the proxy
+        address_list, dns_cached = _resolve(self.host, self.port)
+        dns_time = time.time()
+
+        sock = None
+        last_error = None
+        for family, socktype, proto, canonname, sockaddr in address_list:
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(self.timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                break
+            except socket.error:
+                last_error = sys.exc_info()[1]
+                if sock is not None:
+                    sock.close()
+                sock = None
+
+        if sock is None:
+            # The cached addresses may be stale, resolve again next time
+            _forget(self.host, self.port)
+            raise last_error or socket.error("getaddrinfo returns an empty list")
+
+        try:
+            self.sock = sock
+            if tunnel_host:
+                self._tunnel()
+            tcp_time = time.time()
+
+            if hasattr(self, '_context'):
+                server_hostname = tunnel_host or self.host
+                self.sock = self._context.wrap_socket(sock, server_hostname=server_hostname)
+            else:
+                self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file)
+            tls_time = time.time()
+        except:
+            self.sock = None
+            sock.close()
+            raise
+
+        connect_timing = dict(
+            dns=dns_time - start_time,
+            dns_cached=dns_cached,
+            tcp=tcp_time - dns_time,
+            tls=tls_time - tcp_time,
+            total=tls_time - start_time,
+        )
+        self.connect_timings.append(connect_timing)
+        del self.connect_timings[:-MAX_CONNECT_TIMINGS]
+
+        EVENTBRITE_LOGGER.debug("CONNECT - %s:%s - %r", self.host, self.port, connect_timing)
@@ -0,0 +1,445 @@
+"""Adaptive change polling for Eventbrite events
+
+EventPoller refreshes each watched event on its own schedule:
+1) Events that are live (or about to be) are refreshed every few seconds
+2) Events that are days or months away are refreshed rarely
+3) Events whose data changed recently are refreshed sooner
+
+All API calls made by the poller share a single request budget.  Changes are
+delivered to callbacks registered with add_callback(), including attendees
+that disappear between refreshes (refunds, cancellations) and discovered
+events that list_user_events no longer returns.
+"""
+import datetime
+import heapq
+import logging
+import threading
+import time
+
+from eventbrite.client import EVENTBRITE_DATE_STRING
+
+# Refresh intervals, in seconds
+LIVE_INTERVAL = 30
+IMMINENT_INTERVAL = 5 * 60
+UPCOMING_INTERVAL = 60 * 60
+DISTANT_INTERVAL = 12 * 60 * 60
+ENDED_INTERVAL = 24 * 60 * 60
+USER_EVENTS_INTERVAL = 60 * 60
+
+# Windows around an event that change how often we refresh it
+LIVE_LEAD_TIME = datetime.timedelta(hours=1)
+IMMINENT_LEAD_TIME = datetime.timedelta(days=1)
+UPCOMING_LEAD_TIME = datetime.timedelta(days=7)
+
+# Refresh this many times faster when the last refresh found changes
+RECENT_CHANGE_SPEEDUP = 4
+
+ATTENDEE_PAGE_SIZE = 250
+
+# Change types delivered to callbacks
+EVENT_ADDED = 'event_added'
+EVENT_UPDATED = 'event_updated'
+EVENT_REMOVED = 'event_removed'
+ATTENDEE_ADDED = 'attendee_added'
+ATTENDEE_UPDATED = 'attendee_updated'
+ATTENDEE_REMOVED = 'attendee_removed'
+
+# Error type Eventbrite returns when a list is empty
+NOT_FOUND_ERROR = 'Not Found'
+
+# Pseudo event id used to schedule list_user_events refreshes
+_USER_EVENTS = None
+
+EVENTBRITE_LOGGER = logging.getLogger(__name__)
+
+def _parse_date(date_string):
+    if not date_string:
+        return None
+    try:
+        return datetime.datetime.strptime(date_string, EVENTBRITE_DATE_STRING)
+    except ValueError:
+        return None
+
+def _unwrap_list(api_response, list_key, item_key):
+    """Turns {'events': [{'event': {...}}, ...]} into [{...}, ...]
+
+    Raises: ValueError on any error other than Eventbrite's "Not Found" for an empty list
+    """
+    if api_response and 'error' in api_response:
+        if api_response['error'].get('error_type') == NOT_FOUND_ERROR:
+            return []
+        raise ValueError("Eventbrite error: %r" % (api_response['error'], ))
+    return [wrapped_item[item_key] for wrapped_item in (api_response or {}).get(list_key, [])]
+
+def refresh_interval(start_date, end_date, now, recently_changed=False):
+    """Returns the number of seconds to wait before refreshing an event
+
+    start_date       - datetime - Event start, or None if unknown
+    end_date         - datetime - Event end, or None if unknown
+    now              - datetime - Current time, in the same timezone as the event dates
+    recently_changed - boolean  - The last refresh observed changes
+    """
+    if start_date is None:
+        interval = UPCOMING_INTERVAL
+    elif end_date is not None and now > end_date:
+        interval = ENDED_INTERVAL
+    elif now >= start_date - LIVE_LEAD_TIME:
+        interval = LIVE_INTERVAL
+    elif now >= start_date - IMMINENT_LEAD_TIME:
+        interval = IMMINENT_INTERVAL
+    elif now >= start_date - UPCOMING_LEAD_TIME:
+        interval = UPCOMING_INTERVAL
+    else:
+        interval = DISTANT_INTERVAL
+
+    if recently_changed:
+        interval = max(LIVE_INTERVAL, interval // RECENT_CHANGE_SPEEDUP)
+    return interval
+
+class RequestBudget(object):
+    """Token bucket allowing at most max_requests API calls per period seconds"""
+    def __init__(self, max_requests, period, clock=time.time):
+        assert max_requests > 0 and period > 0
+        self._capacity = float(max_requests)
+        self._fill_rate = float(max_requests) / period
+        self._tokens = self._capacity
+        self._clock = clock
+        self._last_fill = clock()
+        self._lock = threading.Lock()
+
+    def _fill(self):
+        current_time = self._clock()
+        elapsed = max(0.0, current_time - self._last_fill)
+        self._tokens = min(self._capacity, self._tokens + elapsed * self._fill_rate)
+        self._last_fill = current_time
+
+    def available(self):
+        self._lock.acquire()
+        try:
+            self._fill()
+            return int(self._tokens)
+        finally:
+            self._lock.release()
+
+    def try_acquire(self):
+        """Consumes one request from the budget, returns False if none are left"""
+        self._lock.acquire()
+        try:
+            self._fill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+        finally:
+            self._lock.release()
+
+    def wait_time(self):
+        """Seconds until at least one request will be available"""
+        self._lock.acquire()
+        try:
+            self._fill()
+            if self._tokens >= 1:
+                return 0.0
+            return (1 - self._tokens) / self._fill_rate
+        finally:
+            self._lock.release()
+
+class EventPoller(object):
+    """Polls Eventbrite for event and attendee changes on an adaptive schedule"""
+    def __init__(self, client, user_email=None, max_requests=60, period=60, now=datetime.datetime.now):
+        """Initialize the poller
+
+        client       - EventbriteClient - Authenticated client used for all API calls
+        user_email   - string           - If set, discover events with list_user_events for this user
+        max_requests - int              - Global request budget: at most max_requests calls...
+        period       - int              - ...per period seconds
+        now          - function         - Returns the current time in the events' timezone
+        """
+        self._client = client
+        self._user_email = user_email
+        self._budget = RequestBudget(max_requests, period)
+        self._now = now
+
+        self._callbacks = []
+        self._events = {}
+        self._attendees = {}
+        self._recently_changed = {}
+        # Events removed with unwatch_event() that list_user_events must not bring back
+        self._unwatched = set()
+        # Events found by list_user_events, as opposed to passed to watch_event()
+        self._discovered = set()
+
+        # Heap of (due_timestamp, event_id); _due holds the live entry for each event
+        self._schedule = []
+        self._due = {}
+
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        # Set whenever a refresh is scheduled, so the background thread re-checks the schedule
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        if user_email is not None:
+            self._schedule_refresh(_USER_EVENTS, 0)
+
+    def add_callback(self, callback):
+        """Registers callback(change_type, event_id, data) to be called on every change"""
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def watch_event(self, event_id, start_date=None, end_date=None):
+        """Starts polling attendees for event_id, refreshing immediately"""
+        assert type(event_id) == int
+        self._lock.acquire()
+        try:
+            event = self._events.setdefault(event_id, {'id': event_id})
+            if start_date is not None:
+                event['start_date'] = start_date.strftime(EVENTBRITE_DATE_STRING)
+            if end_date is not None:
+                event['end_date'] = end_date.strftime(EVENTBRITE_DATE_STRING)
+            self._attendees.setdefault(event_id, {})
+            self._unwatched.discard(event_id)
+            self._discovered.discard(event_id)
+            self._schedule_refresh(event_id, 0)
+        finally:
+            self._lock.release()
+
+    def unwatch_event(self, event_id):
+        """Stops polling event_id, even if list_user_events still returns it"""
+        self._lock.acquire()
+        try:
+            self._unwatched.add(event_id)
+            self._forget_event(event_id)
+        finally:
+            self._lock.release()
+
+    def get_attendees(self, event_id):
+        """Returns a copy of the last known attendees of event_id, keyed by attendee id"""
+        self._lock.acquire()
+        try:
+            return dict(self._attendees.get(event_id, {}))
+        finally:
+            self._lock.release()
+
+    def poll(self):
+        """Refreshes every event that is due, as far as the request budget allows
+
+        Returns: Seconds until the next refresh is due or the budget refills
+        """
+        while True:
+            self._lock.acquire()
+            try:
+                event_id, due_timestamp = self._pop_due_event()
+            finally:
+                self._lock.release()
+
+            if event_id is False:
+                break
+            if not self._budget.try_acquire():
+                # Out of budget - put the event back where it was in the queue
+                self._lock.acquire()
+                try:
+                    if self._is_watched(event_id):
+                        self._schedule_at(event_id, due_timestamp)
+                finally:
+                    self._lock.release()
+                return self._budget.wait_time()
+
+            try:
+                if event_id is _USER_EVENTS:
+                    self._refresh_user_events()
+                else:
+                    self._refresh_event(event_id)
+            except Exception:
+                EVENTBRITE_LOGGER.exception("Failed to refresh event %r", event_id)
+                self._lock.acquire()
+                try:
+                    if self._is_watched(event_id):
+                        self._schedule_refresh(event_id, self._next_interval(event_id))
+                finally:
+                    self._lock.release()
+
+        self._lock.acquire()
+        try:
+            return self._seconds_until_next()
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """Starts polling in a background daemon thread"""
+        assert self._thread is None, "Poller already started"
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='eventbrite-poller')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the background thread started with start()"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.isSet():
+            self._wakeup.clear()
+            wait_time = self.poll()
+            if wait_time is None or wait_time > LIVE_INTERVAL:
+                wait_time = LIVE_INTERVAL
+            self._wakeup.wait(max(wait_time, 0.1))
+
+    ###########################################################################
+    ############################## SCHEDULING #################################
+    ###########################################################################
+    def _is_watched(self, event_id):
+        return event_id is _USER_EVENTS or event_id in self._attendees
+
+    def _forget_event(self, event_id):
+        self._events.pop(event_id, None)
+        self._attendees.pop(event_id, None)
+        self._recently_changed.pop(event_id, None)
+        self._due.pop(event_id, None)
+        self._discovered.discard(event_id)
+
+    def _schedule_refresh(self, event_id, delay):
+        self._schedule_at(event_id, time.time() + delay)
+
+    def _schedule_at(self, event_id, due_timestamp):
+        self._due[event_id] = due_timestamp
+        heapq.heappush(self._schedule, (due_timestamp, event_id))
+        self._wakeup.set()
+
+    def _pop_due_event(self):
+        """Returns (event id, due timestamp) of the next due event, or (False, None) if nothing is due"""
+        current_timestamp = time.time()
+        while self._schedule:
+            due_timestamp, event_id = self._schedule[0]
+            if self._due.get(event_id, -1) != due_timestamp:
+                # Stale entry from a reschedule or unwatch_event
+                heapq.heappop(self._schedule)
+                continue
+            if due_timestamp > current_timestamp:
+                return False, None
+            heapq.heappop(self._schedule)
+            del self._due[event_id]
+            return event_id, due_timestamp
+        return False, None
+
+    def _seconds_until_next(self):
+        if not self._due:
+            return None
+        return max(0.0, min(self._due.values()) - time.time())
+
+    def _next_interval(self, event_id):
+        if event_id is _USER_EVENTS:
+            return USER_EVENTS_INTERVAL
+        event = self._events.get(event_id, {})
+        return refresh_interval(
+            _parse_date(event.get('start_date')),
+            _parse_date(event.get('end_date')),
+            self._now(),
+            recently_changed=self._recently_changed.get(event_id, False),
+        )
+
+    ###########################################################################
+    ############################### REFRESHES #################################
+    ###########################################################################
+    def _refresh_user_events(self):
+        api_response = self._client.list_user_events(user_email=self._user_email)
+        changes = []
+
+        self._lock.acquire()
+        try:
+            returned_ids = set()
+            for event in _unwrap_list(api_response, 'events', 'event'):
+                event_id = int(event['id'])
+                returned_ids.add(event_id)
+                if event_id in self._unwatched:
+                    continue
+                known_event = self._events.get(event_id)
+                if known_event is None or event_id not in self._attendees:
+                    changes.append((EVENT_ADDED, event_id, event))
+                    self._discovered.add(event_id)
+                    self._attendees[event_id] = {}
+                    self._events[event_id] = event
+                    self._schedule_refresh(event_id, 0)
+                elif known_event != event:
+                    changes.append((EVENT_UPDATED, event_id, event))
+                    self._events[event_id] = event
+                    if event_id in self._due:
+                        # Dates may have moved - reschedule from the new dates
+                        self._schedule_refresh(event_id, self._next_interval(event_id))
+
+            # Deleted or no longer the user's - stop spending budget on them
+            for event_id in self._discovered - returned_ids:
+                changes.append((EVENT_REMOVED, event_id, self._events.get(event_id, {'id': event_id})))
+                self._forget_event(event_id)
+
+            self._schedule_refresh(_USER_EVENTS, USER_EVENTS_INTERVAL)
+        finally:
+            self._lock.release()
+
+        self._notify(changes)
+
+    def _refresh_event(self, event_id):
+        # The first page was already paid for by poll()
+        attendee_list = []
+        page = 1
+        while True:
+            api_response = self._client.list_event_attendees(event_id=event_id, count=ATTENDEE_PAGE_SIZE, page=page, show_full_barcodes=True)
+            page_attendees = _unwrap_list(api_response, 'attendees', 'attendee')
+            attendee_list.extend(page_attendees)
+            if len(page_attendees) < ATTENDEE_PAGE_SIZE:
+                break
+            page += 1
+            while not self._budget.try_acquire():
+                self._stop_event.wait(self._budget.wait_time())
+                if self._stop_event.isSet():
+                    self._lock.acquire()
+                    try:
+                        if self._is_watched(event_id):
+                            self._schedule_refresh(event_id, 0)
+                    finally:
+                        self._lock.release()
+                    return
+
+        changes = []
+        self._lock.acquire()
+        try:
+            known_attendees = self._attendees.get(event_id)
+            if known_attendees is None:
+                # Unwatched while we were fetching
+                return
+            current_attendees = {}
+            for attendee in attendee_list:
+                attendee_id = int(attendee['id'])
+                known_attendee = known_attendees.get(attendee_id)
+                if known_attendee is None:
+                    changes.append((ATTENDEE_ADDED, event_id, attendee))
+                elif known_attendee != attendee:
+                    changes.append((ATTENDEE_UPDATED, event_id, attendee))
+                current_attendees[attendee_id] = attendee
+
+            for attendee_id, known_attendee in known_attendees.items():
+                if attendee_id not in current_attendees:
+                    changes.append((ATTENDEE_REMOVED, event_id, known_attendee))
+
+            self._attendees[event_id] = current_attendees
+
+            self._recently_changed[event_id] = bool(changes)
+            self._schedule_refresh(event_id, self._next_interval(event_id))
+        finally:
+            self._lock.release()
+
+        self._notify(changes)
+
+    def _notify(self, changes):
+        for change_type, event_id, data in changes:
+            for callback in list(self._callbacks):
+                try:
+                    callback(change_type, event_id, data)
+                except Exception:
+                    EVENTBRITE_LOGGER.exception("Callback %r failed on %s for event %r", callback, change_type, event_id)